@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 # flake8: NOQA
-from parglare.parser import Parser, Token, LALR, SLR, pos_to_line_col, \
-    SHIFT, REDUCE, ACCEPT, Node, NodeTerm, NodeNonTerm
+from parglare.parser import Parser, Token, LALR, LALR_DP, SLR, \
+    pos_to_line_col, SHIFT, REDUCE, ACCEPT, Node, NodeTerm, NodeNonTerm
 from parglare.glr import GLRParser
 from parglare.grammar import Grammar, NonTerminal, Terminal, \
     RegExRecognizer, EMPTY, EOF, STOP
@@ -6,93 +6,164 @@ LR_0 = 0
 LR_1 = 1
 
 
-def closure(state, itemset_type, first_sets=None):
+class ClosureCache(object):
+    """
+    Memoizes calculations done during closure of LR states. Valid only for a
+    single table construction as it depends on the grammar start production
+    and the first sets.
+
+    Attributes:
+    kernels(dict): LR(0) closures keyed by the tuple of kernel items
+        (prod_id, position) in the order of state items. Each value is a tuple
+        of the list of (prod_id, position) of all closure items, the list of
+        non-kernel productions in the order of addition and the list of
+        (item index, target item indexes, tail first set, tail nullable) for
+        each item with a non-terminal at the position.
+    tails(dict): A pair of the first set (int bitset) of the rest of the
+        production after the non-terminal at the position and the flag whether
+        the rest can derive EMPTY. Keyed by (prod_id, position).
+    """
+    def __init__(self):
+        self.kernels = {}
+        self.tails = {}
+
+
+def closure(state, itemset_type, first_sets=None, cache=None):
     """
     For the given LRState calculates its LR(0)/LR(1) itemset closure.
 
     Args:
     state(LRState):
     itemset_type(int): LR_0 or LR_1
-    first_sets(dict of sets): Used in LR_1 itemsets calculation.
+    first_sets(dict of int): First sets as int bitsets of terminal ids keyed
+        by grammar symbol. Used in LR_1 itemsets calculation.
+    cache(ClosureCache): If given, LR(0) closures are memoized by kernel.
     """
+    if cache is None:
+        cache = ClosureCache()
 
-    while True:
-
-        has_additions = False
-        to_add = []
-        for item in state.items:
-            gs = item.symbol_at_position
-            if isinstance(gs, NonTerminal):
-                for p in state.grammar.productions:
-
-                    if p.symbol == gs:
-
-                        if itemset_type is LR_1:
-                            # Calculate follow set that is possible after the
-                            # non-terminal at the given position of the current
-                            # item.
-                            follow = _new_item_follow(item, first_sets)
-                            new_item = LRItem(p, 0, follow)
-                        else:
-                            new_item = LRItem(p, 0)
-
-                        if new_item not in state.items \
-                                and new_item not in to_add:
-
-                            # If the item doesn't exists yet add it.
-                            to_add.append(new_item)
-                            has_additions = True
-
-                        else:
-                            # If the item already exists, this newly created
-                            # item might still have a wider follows set. If so,
-                            # update with the current new item follows set if
-                            # we are building LR_1 items set.
-                            if itemset_type is LR_1:
-                                try:
-                                    existing_item = state.items[
-                                        state.items.index(new_item)]
-                                except ValueError:
-                                    existing_item = to_add[
-                                        to_add.index(new_item)]
-
-                                if not follow.issubset(existing_item.follow):
-                                    existing_item.follow.update(follow)
-                                    has_additions = True
-
-        if has_additions:
-            state.items.extend(to_add)
-        else:
-            break
+    kernel = tuple([(i.production.prod_id, i.position)
+                    for i in state.items if i.is_kernel])
+
+    lr0 = cache.kernels.get(kernel)
+    if lr0 is None:
+        lr0 = _lr0_closure(state, itemset_type, first_sets, cache)
+        cache.kernels[kernel] = lr0
+    keys, nonkernel_prods, edges = lr0
+
+    # Add non-kernel items that are missing. If the state is already closed
+    # existing items are reused as we might be just refreshing follows.
+    existing = dict([((i.production.prod_id, i.position), i)
+                     for i in state.items])
+    for p in nonkernel_prods:
+        if (p.prod_id, 0) not in existing:
+            new_item = LRItem(p, 0)
+            existing[(p.prod_id, 0)] = new_item
+            state.items.append(new_item)
 
+    if itemset_type is LR_1:
+        _propagate_follows([existing[k] for k in keys], edges)
 
-def _new_item_follow(item, first_sets):
+
+def _lr0_closure(state, itemset_type, first_sets, cache):
+    """
+    Calculates LR(0) closure of the given state items without changing the
+    state. Items are added in the breadth-first order.
+    """
+    productions_by_symbol = state.grammar.productions_by_symbol
+    items = [(i.production, i.position) for i in state.items
+             if i.is_kernel]
+    index = dict([((p.prod_id, pos), idx)
+                  for idx, (p, pos) in enumerate(items)])
+    nonkernel_prods = []
+    edges = []
+
+    idx = 0
+    while idx < len(items):
+        production, position = items[idx]
+        symbol = production.rhs[position]
+        if isinstance(symbol, NonTerminal):
+            targets = []
+            for p in productions_by_symbol[symbol]:
+                target = index.get((p.prod_id, 0))
+                if target is None:
+                    target = len(items)
+                    index[(p.prod_id, 0)] = target
+                    items.append((p, 0))
+                    nonkernel_prods.append(p)
+                targets.append(target)
+
+            if itemset_type is LR_1:
+                tail_first, nullable = _tail_first(production, position,
+                                                   first_sets, cache)
+                edges.append((idx, targets, tail_first, nullable))
+        idx += 1
+
+    keys = [(p.prod_id, pos) for p, pos in items]
+    return keys, nonkernel_prods, edges
+
+
+def _propagate_follows(items, edges):
+    """
+    Updates follow sets of non-kernel items. Each item created for a
+    non-terminal at the position of the source item gets terminals that can
+    follow the non-terminal and, if the rest of the source production can
+    derive EMPTY, the follow set of the source item.
     """
-    Returns follow set of possible terminals after the item's current
-    non-terminal.
+    propagating = {}
+    for source, targets, tail_first, nullable in edges:
+        for target in targets:
+            items[target].follow |= tail_first
+        if nullable:
+            propagating[source] = targets
+
+    to_process = list(propagating)
+    while to_process:
+        source = to_process.pop()
+        follow = items[source].follow
+        for target in propagating[source]:
+            target_item = items[target]
+            if follow & ~target_item.follow:
+                target_item.follow |= follow
+                if target in propagating:
+                    to_process.append(target)
+
+
+def _tail_first(production, position, first_sets, cache):
+    """
+    Returns the bitset of possible terminals after the non-terminal at the
+    given position of the production and the flag that tells if the rest of the
+    production can derive EMPTY in which case the follow set of the source
+    item should be inherited.
 
     Args:
-    item (LRItem): The source item which is causing the creation of the
-        new item.
-    first_sets(dict of sets): The dict of set of first items keyed by
+    production (Production):
+    position (int): The position of the non-terminal in the production.
+    first_sets(dict of int): The dict of bitsets of first terminals keyed by
         a grammar symbol.
+    cache(ClosureCache):
     """
-
-    new_follow = set()
-    for s in item.production.rhs[item.position + 1:]:
-        new_follow.update(first_sets[s])
-        if EMPTY not in new_follow:
-            # If EMPTY can't be derived at current position than we have found
-            # the whole follow set.
-            break
+    key = (production.prod_id, position)
+    tail = cache.tails.get(key)
+    if tail is None:
+        empty = 1 << production.grammar.terminal_ids[EMPTY]
+        new_follow = 0
+        for s in production.rhs[position + 1:]:
+            new_follow |= first_sets[s]
+            if not new_follow & empty:
+                # If EMPTY can't be derived at current position than we have
+                # found the whole follow set.
+                nullable = False
+                break
+            else:
+                # If the EMPTY is possible at current position in this loop we
+                # must continue to include firsts of the next grammar symbol.
+                # EMTPY can't be a member of the follow set.
+                new_follow &= ~empty
         else:
-            # If the EMPTY is possible at current position in this loop we must
-            # continue to include firsts of the next grammar symbol.
-            # EMTPY can't be a member of the follow set.
-            new_follow.remove(EMPTY)
-    else:
-        # If the rest of production can be EMPTY we shall inherit
-        # all elements of the source item follow set.
-        new_follow.update(item.follow)
-
-    return new_follow
+            # If the rest of production can be EMPTY we shall inherit
+            # all elements of the source item follow set.
+            nullable = True
+        tail = cache.tails[key] = (new_follow, nullable)
+
+    return tail
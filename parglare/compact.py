@@ -0,0 +1,628 @@
+# -*- coding: utf-8 -*-
+"""
+Compact form of LR tables used by parsers at runtime.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import copy
+import mmap
+import struct
+from array import array
+from .parser import Action, SHIFT, REDUCE, ACCEPT
+from .exceptions import SRConflict, RRConflict
+from .tables import _init_start_production
+
+if sys.version < '3':
+    text = unicode  # noqa
+else:
+    text = str
+
+
+# Action kind is encoded in the lowest two bits of the action code. The rest
+# of the code is the target state id for SHIFT/ACCEPT, the production id for
+# REDUCE or the index of the action list if there are multiple actions.
+MULTIPLE = 3
+KIND_BITS = 2
+KIND_MASK = 3
+KINDS = (SHIFT, REDUCE, ACCEPT)
+
+# Names of all arrays that make a compact table.
+TABLE_ARRAYS = ['state_symbols', 'state_action_rows', 'state_goto_rows',
+                'action_row_starts', 'action_row_terminals',
+                'action_row_codes', 'action_row_finish', 'action_row_dynamic',
+                'multi_starts', 'multi_codes',
+                'action_base', 'action_check', 'action_value',
+                'goto_base', 'goto_check', 'goto_value']
+
+# Version of the compact table file format.
+COMPACT_TABLE_VERSION = 1
+COMPACT_TABLE_MAGIC = b'PGCTABLE'
+
+# File header: magic, version, byte order marker, fingerprint, number of
+# arrays. Byte order marker is written in the native byte order of the
+# machine that created the file.
+_HEADER = struct.Struct('=8sII40sI')
+_BYTE_ORDER_MARK = 0x01020304
+# Array directory entry: typecode, item size, offset, length.
+_ENTRY = struct.Struct('=cxHQQ')
+# Arrays are aligned in the file to this number of bytes.
+_ALIGN = 8
+
+
+class CompactTable(object):
+    """
+    LR table compiled to integer symbol and state ids kept in flat arrays.
+
+    Terminals and non-terminals are identified by their grammar ids (see
+    `Grammar.terminal_ids` and `Grammar.nonterminal_ids`). State symbols use a
+    common id space where non-terminal ids follow terminal ids.
+
+    Actions of each state form a row of (terminal, action code) pairs in the
+    scanning order together with the finish and dynamic flags. Identical rows
+    are shared between states. For the lookup by terminal all rows are
+    overlaid in a single pair of check/value arrays using row displacement,
+    i.e. the action code for terminal t in row r is at `action_base[r] + t` if
+    `action_check` at that position is r. GOTO rows are shared and overlaid in
+    the same way.
+
+    Parser and GLRParser use the table through lightweight state objects
+    (see `CompactState`) which are created on the first access.
+
+    The table can be saved to a binary file and loaded with `mmap` in which
+    case the arrays are used in place (see `save` and `load`).
+
+    Attributes:
+    grammar(Grammar):
+    states(CompactStates): A sequence of states.
+    symbols(list): Grammar symbols by the state symbol id.
+    state_symbols(array): Symbol id of each state.
+    state_action_rows, state_goto_rows(array): Action and goto row id of each
+        state.
+    action_row_starts(array): Start index of each action row in the row
+        arrays with one additional element for the end of the last row.
+    action_row_terminals, action_row_codes, action_row_finish,
+    action_row_dynamic(array): Terminal ids, action codes, finish flags and
+        dynamic disambiguation flags of action row entries.
+    multi_starts, multi_codes(array): Action codes of multiple actions for a
+        single terminal. `multi_starts` has one additional element.
+    action_base, action_check, action_value(array): Lookup of action codes
+        by row and terminal id.
+    goto_base, goto_check, goto_value(array): Lookup of goto target states by
+        goto row and non-terminal id.
+    sr_conflicts, rr_conflicts(list):
+    """
+    def __init__(self, grammar, arrays, sr_conflicts=None, rr_conflicts=None):
+        self.grammar = grammar
+        for name in TABLE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.symbols = grammar.terminals_by_id + grammar.nonterminals_by_id
+        self.states = CompactStates(self)
+        self.sr_conflicts = sr_conflicts if sr_conflicts else []
+        self.rr_conflicts = rr_conflicts if rr_conflicts else []
+
+        # Action lists keyed by action code and action rows keyed by row id.
+        self._actions = {}
+        self._action_rows = {}
+
+        # The mapped file if the table is loaded by `CompactTable.load`.
+        self._buffer = None
+
+    @staticmethod
+    def from_table(table):
+        """
+        Compiles the given LRTable. The returned table doesn't reference
+        LRTable states.
+        """
+        grammar = table.grammar
+        terminal_ids = grammar.terminal_ids
+        nonterminal_ids = grammar.nonterminal_ids
+        terminals_num = len(terminal_ids)
+
+        def encode(action):
+            if action.action is REDUCE:
+                operand = action.prod.prod_id
+            else:
+                operand = action.state.state_id
+            return operand << KIND_BITS | action.action
+
+        multi_starts = array('i', [0])
+        multi_codes = array('i')
+        multi_ids = {}
+
+        def encode_actions(actions):
+            if len(actions) == 1:
+                return encode(actions[0])
+            codes = tuple([encode(a) for a in actions])
+            multi_id = multi_ids.get(codes)
+            if multi_id is None:
+                multi_id = multi_ids[codes] = len(multi_starts) - 1
+                multi_codes.extend(codes)
+                multi_starts.append(len(multi_codes))
+            return multi_id << KIND_BITS | MULTIPLE
+
+        state_symbols = array('i')
+        state_action_rows = array('i')
+        state_goto_rows = array('i')
+        action_rows = _Rows()
+        goto_rows = _Rows()
+
+        for state in table.states:
+            symbol = state.symbol
+            if symbol in terminal_ids:
+                state_symbols.append(terminal_ids[symbol])
+            else:
+                state_symbols.append(terminals_num + nonterminal_ids[symbol])
+
+            state_action_rows.append(action_rows.add(
+                tuple([(terminal_ids[t], encode_actions(acts),
+                        finish, t in state.dynamic)
+                       for (t, acts), finish in zip(state.actions.items(),
+                                                    state.finish_flags)])))
+
+            state_goto_rows.append(goto_rows.add(
+                tuple(sorted([(nonterminal_ids[nt], target.state_id)
+                              for nt, target in state.gotos.items()]))))
+
+        action_row_starts = array('i', [0])
+        action_row_terminals = array('i')
+        action_row_codes = array('i')
+        action_row_finish = array('b')
+        action_row_dynamic = array('b')
+        for row in action_rows.rows:
+            for term_id, code, finish, dynamic in row:
+                action_row_terminals.append(term_id)
+                action_row_codes.append(code)
+                action_row_finish.append(finish)
+                action_row_dynamic.append(dynamic)
+            action_row_starts.append(len(action_row_terminals))
+
+        action_base, action_check, action_value = _displace(
+            [[(e[0], e[1]) for e in row] for row in action_rows.rows],
+            terminals_num)
+        goto_base, goto_check, goto_value = _displace(
+            goto_rows.rows, len(nonterminal_ids))
+
+        compact_table = CompactTable(grammar, {
+            'state_symbols': state_symbols,
+            'state_action_rows': state_action_rows,
+            'state_goto_rows': state_goto_rows,
+            'action_row_starts': action_row_starts,
+            'action_row_terminals': action_row_terminals,
+            'action_row_codes': action_row_codes,
+            'action_row_finish': action_row_finish,
+            'action_row_dynamic': action_row_dynamic,
+            'multi_starts': multi_starts,
+            'multi_codes': multi_codes,
+            'action_base': action_base,
+            'action_check': action_check,
+            'action_value': action_value,
+            'goto_base': goto_base,
+            'goto_check': goto_check,
+            'goto_value': goto_value,
+        })
+
+        # Conflicts are kept for reporting but they now reference compact
+        # states.
+        for conflicts, compact_conflicts in \
+                [(table.sr_conflicts, compact_table.sr_conflicts),
+                 (table.rr_conflicts, compact_table.rr_conflicts)]:
+            for conflict in conflicts:
+                conflict = copy.copy(conflict)
+                conflict.state = compact_table.states[conflict.state.state_id]
+                compact_conflicts.append(conflict)
+
+        return compact_table
+
+    def save(self, file_name, fingerprint):
+        """
+        Writes the table arrays to the given binary file which can be later
+        opened with `CompactTable.load` and used in place.
+
+        The file is written in the native byte order and integer sizes.
+        Conflicts are stored as an additional array of records:
+        kind (0 for S/R, 1 for R/R), state id, terminal id, number of
+        productions followed by the production ids.
+        """
+        conflicts = array('i')
+        for kind, kind_conflicts in enumerate([self.sr_conflicts,
+                                               self.rr_conflicts]):
+            for conflict in kind_conflicts:
+                conflicts.extend([kind, conflict.state.state_id,
+                                  self.grammar.terminal_ids[conflict.term],
+                                  len(conflict.productions)])
+                conflicts.extend([p.prod_id for p in conflict.productions])
+
+        arrays = [getattr(self, name) for name in TABLE_ARRAYS] + [conflicts]
+        offset = _HEADER.size + _ENTRY.size * len(arrays)
+        entries = []
+        for arr in arrays:
+            offset = _aligned(offset)
+            entries.append(_ENTRY.pack(arr.typecode.encode('ascii'),
+                                       arr.itemsize, offset, len(arr)))
+            offset += arr.itemsize * len(arr)
+
+        with open(file_name, 'wb') as f:
+            f.write(_HEADER.pack(COMPACT_TABLE_MAGIC, COMPACT_TABLE_VERSION,
+                                 _BYTE_ORDER_MARK,
+                                 fingerprint.encode('ascii'), len(arrays)))
+            for entry in entries:
+                f.write(entry)
+            for arr in arrays:
+                f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+                f.write(_array_bytes(arr))
+
+    @staticmethod
+    def load(file_name, grammar, fingerprint, start_production=1):
+        """
+        Opens the compact table file created by `CompactTable.save` with
+        `mmap` and returns the table whose arrays are views into the mapped
+        file. The pages of the file are shared by all processes using the
+        table so the table doesn't take private memory in forked worker
+        processes.
+
+        Returns None if the file doesn't exist, is damaged, created on a
+        platform with a different byte order or integer sizes, or for a
+        different grammar, i.e. the fingerprint doesn't match.
+        """
+        try:
+            with open(file_name, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            magic, version, bom, file_fingerprint, arrays_num = \
+                _HEADER.unpack_from(buf, 0)
+            if magic != COMPACT_TABLE_MAGIC \
+               or version != COMPACT_TABLE_VERSION \
+               or bom != _BYTE_ORDER_MARK \
+               or file_fingerprint != fingerprint.encode('ascii') \
+               or arrays_num != len(TABLE_ARRAYS) + 1:
+                return None
+
+            arrays = []
+            for idx in range(arrays_num):
+                typecode, itemsize, offset, length = _ENTRY.unpack_from(
+                    buf, _HEADER.size + idx * _ENTRY.size)
+                typecode = typecode.decode('ascii')
+                if itemsize != array(typecode).itemsize \
+                   or offset + itemsize * length > len(buf):
+                    return None
+                arrays.append(_array_view(buf, typecode, offset,
+                                          itemsize * length))
+        except (struct.error, ValueError, LookupError, TypeError):
+            return None
+
+        _init_start_production(grammar, start_production)
+        table = CompactTable(grammar, dict(zip(TABLE_ARRAYS, arrays)))
+        table._buffer = buf
+
+        conflicts = arrays[-1]
+        idx = 0
+        while idx < len(conflicts):
+            kind, state_id, term_id, prods_num = conflicts[idx:idx + 4]
+            prods = [grammar.productions[prod_id]
+                     for prod_id in conflicts[idx + 4:idx + 4 + prods_num]]
+            state = table.states[state_id]
+            term = grammar.terminals_by_id[term_id]
+            if kind == 0:
+                table.sr_conflicts.append(SRConflict(state, term, prods))
+            else:
+                table.rr_conflicts.append(RRConflict(state, term, prods))
+            idx += 4 + prods_num
+
+        return table
+
+    def action_row(self, row_id):
+        """
+        Returns CompactActions for the given action row id.
+        """
+        row = self._action_rows.get(row_id)
+        if row is None:
+            row = self._action_rows[row_id] = CompactActions(self, row_id)
+        return row
+
+    def decode_actions(self, code):
+        """
+        Returns a list of Action instances for the given action code.
+        """
+        actions = self._actions.get(code)
+        if actions is None:
+            if code & KIND_MASK == MULTIPLE:
+                multi_id = code >> KIND_BITS
+                codes = self.multi_codes[self.multi_starts[multi_id]:
+                                         self.multi_starts[multi_id + 1]]
+            else:
+                codes = [code]
+            actions = []
+            for action_code in codes:
+                kind = KINDS[action_code & KIND_MASK]
+                operand = action_code >> KIND_BITS
+                if kind is REDUCE:
+                    actions.append(Action(kind, prod=self.grammar.productions[
+                        operand]))
+                else:
+                    actions.append(Action(kind, state=self.states[operand]))
+            self._actions[code] = actions
+        return actions
+
+    def print_debug(self):
+        print("\n\n*** STATES ***")
+        for state in self.states:
+            state.print_debug()
+
+            if state.gotos:
+                print("\n\n\tGOTO:")
+                print("\t", ", ".join(["%s->%d" % (k, v.state_id)
+                                       for k, v in state.gotos.items()]))
+            print("\n\tACTIONS:")
+            print("\t", ", ".join(
+                ["%s->%s" % (k, str(v[0])
+                             if len(v) == 1 else "[{}]".format(
+                                     ",".join([str(x) for x in v])))
+                 for k, v in state.actions.items()]))
+
+        if self.sr_conflicts:
+            print("\n\n*** S/R conflicts ***")
+            print("There are {} S/R conflicts".format(len(self.sr_conflicts)))
+            for src in self.sr_conflicts:
+                print(src.message)
+
+        if self.rr_conflicts:
+            print("\n\n*** R/R conflicts ***\n")
+            for rrc in self.rr_conflicts:
+                print(rrc.message)
+
+
+class CompactStates(object):
+    """
+    A sequence of states of the compact table. States are created on the
+    first access.
+    """
+    def __init__(self, table):
+        self.table = table
+        self._states = [None] * len(table.state_symbols)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __getitem__(self, state_id):
+        state = self._states[state_id]
+        if state is None:
+            state = self._states[state_id] = CompactState(self.table,
+                                                          state_id)
+        return state
+
+    def __iter__(self):
+        for state_id in range(len(self._states)):
+            yield self[state_id]
+
+
+class CompactState(object):
+    """
+    A state of the compact table. Provides the same interface as LRState
+    used by parsers but without LR items.
+    """
+    __slots__ = ['state_id', 'symbol', 'actions', 'gotos', 'finish_flags',
+                 'dynamic']
+
+    def __init__(self, table, state_id):
+        self.state_id = state_id
+        self.symbol = table.symbols[table.state_symbols[state_id]]
+        self.actions = table.action_row(table.state_action_rows[state_id])
+        self.finish_flags = self.actions.finish_flags
+        self.dynamic = self.actions.dynamic
+        self.gotos = CompactGotos(table, table.state_goto_rows[state_id])
+
+    def __str__(self):
+        return "\nState %d:%s\n" % (self.state_id, self.symbol)
+
+    def __unicode__(self):
+        return str(self)
+
+    def print_debug(self):
+        print(text(self))
+
+
+class CompactActions(object):
+    """
+    Actions of the compact table row. A read-only mapping of terminals to the
+    lists of Action instances ordered for scanning.
+    """
+    __slots__ = ['table', 'row_id', 'start', 'end', 'finish_flags',
+                 'dynamic']
+
+    def __init__(self, table, row_id):
+        self.table = table
+        self.row_id = row_id
+        self.start = table.action_row_starts[row_id]
+        self.end = table.action_row_starts[row_id + 1]
+        self.finish_flags = table.action_row_finish[self.start:self.end]
+        dynamic = table.action_row_dynamic[self.start:self.end]
+        self.dynamic = frozenset([t for t, d in zip(self.keys(), dynamic)
+                                  if d]) if any(dynamic) else _NO_DYNAMIC
+
+    def get(self, symbol, default=None):
+        table = self.table
+        term_id = table.grammar.terminal_ids.get(symbol)
+        if term_id is not None:
+            idx = table.action_base[self.row_id] + term_id
+            if table.action_check[idx] == self.row_id:
+                return table.decode_actions(table.action_value[idx])
+        return default
+
+    def __getitem__(self, symbol):
+        actions = self.get(symbol)
+        if actions is None:
+            raise KeyError(symbol)
+        return actions
+
+    def __contains__(self, symbol):
+        return self.get(symbol) is not None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        terminals = self.table.grammar.terminals_by_id
+        row_terminals = self.table.action_row_terminals
+        for idx in range(self.start, self.end):
+            yield terminals[row_terminals[idx]]
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        decode = self.table.decode_actions
+        return [decode(code)
+                for code in self.table.action_row_codes[self.start:self.end]]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+
+_NO_DYNAMIC = frozenset()
+
+
+class CompactGotos(object):
+    """
+    Gotos of the compact table row. A read-only mapping of non-terminals to
+    target states.
+    """
+    __slots__ = ['table', 'row_id']
+
+    def __init__(self, table, row_id):
+        self.table = table
+        self.row_id = row_id
+
+    def get(self, symbol, default=None):
+        table = self.table
+        nonterm_id = table.grammar.nonterminal_ids.get(symbol)
+        if nonterm_id is not None:
+            idx = table.goto_base[self.row_id] + nonterm_id
+            if table.goto_check[idx] == self.row_id:
+                return table.states[table.goto_value[idx]]
+        return default
+
+    def __getitem__(self, symbol):
+        state = self.get(symbol)
+        if state is None:
+            raise KeyError(symbol)
+        return state
+
+    def __contains__(self, symbol):
+        return self.get(symbol) is not None
+
+    def items(self):
+        return [(nt, self.get(nt))
+                for nt in self.table.grammar.nonterminals_by_id
+                if nt in self]
+
+    def keys(self):
+        return [nt for nt, _ in self.items()]
+
+    def values(self):
+        return [state for _, state in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+
+def compact_table_file_name(table_file_name):
+    """
+    Returns the name of the compact table file for the given LR table cache
+    file name.
+    """
+    return os.path.splitext(table_file_name)[0] + '.pgc'
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+if sys.version < '3':
+    def _array_bytes(arr):
+        return arr.tostring()
+
+    def _array_view(buf, typecode, offset, size):
+        # Python 2 memoryview can't be cast to the array item type so the
+        # data is copied.
+        arr = array(typecode)
+        arr.fromstring(buf[offset:offset + size])
+        return arr
+else:
+    def _array_bytes(arr):
+        return arr.tobytes()
+
+    def _array_view(buf, typecode, offset, size):
+        return memoryview(buf)[offset:offset + size].cast(typecode)
+
+
+class _Rows(object):
+    """
+    Collects unique rows and assigns them ids.
+    """
+    def __init__(self):
+        self.rows = []
+        self.row_ids = {}
+
+    def add(self, row):
+        row_id = self.row_ids.get(row)
+        if row_id is None:
+            row_id = self.row_ids[row] = len(self.rows)
+            self.rows.append(row)
+        return row_id
+
+
+def _displace(rows, width):
+    """
+    Overlays sparse rows given as lists of (column, value) pairs using row
+    displacement. Returns base, check and value arrays where the value at the
+    given column of row r is at base[r] + column if check is r at that index.
+    Rows with more entries are placed first as they are harder to fit.
+    """
+    base = array('i', [0] * len(rows))
+    check = []
+    value = []
+    first_free = 0
+    for row_id in sorted(range(len(rows)), key=lambda r: -len(rows[r])):
+        row = rows[row_id]
+        if not row:
+            continue
+        while first_free < len(check) and check[first_free] != -1:
+            first_free += 1
+        columns = sorted([c for c, _ in row])
+        min_column = columns[0]
+        row_base = max(first_free - min_column, 0)
+        size = len(check)
+        while True:
+            for column in columns:
+                idx = row_base + column
+                if idx >= size:
+                    break
+                if check[idx] != -1:
+                    row_base += 1
+                    break
+            else:
+                break
+            if idx >= size:
+                break
+        base[row_id] = row_base
+        needed = row_base + columns[-1] + 1
+        if needed > size:
+            check.extend([-1] * (needed - size))
+            value.extend([0] * (needed - size))
+        for column, val in row:
+            check[row_base + column] = row_id
+            value[row_base + column] = val
+
+    # Padding for lookups of all columns of the last rows.
+    size = (max(base) if rows else 0) + width
+    if size > len(check):
+        check.extend([-1] * (size - len(check)))
+        value.extend([0] * (size - len(value)))
+    return base, array('i', check), array('i', value)
@@ -165,6 +165,7 @@ class Production(object):
     prod_id (int): Ordinal number of the production.
     prod_symbol_id (int): A zero-based ordinal of alternative choice for this
         production grammar symbol.
+    grammar (Grammar): The grammar this production belongs to.
     """
 
     def __init__(self, symbol, rhs, assoc=ASSOC_NONE, prior=DEFAULT_PRIORITY,
@@ -225,6 +226,16 @@ class Grammar(object):
         terminal recognizers not specified in the grammar.
     nonterminals (set of NonTerminal):
     terminals(set of Terminal):
+    productions_by_symbol (dict): A list of productions keyed by the LHS
+        non-terminal in the order of definition.
+    terminal_ids (dict): A zero-based dense index of terminals keyed by
+        terminal. Used to represent sets of terminals as int bitsets.
+    terminals_by_id (list): Terminals ordered by their index.
+    nonterminal_ids (dict): A zero-based dense index of non-terminals keyed
+        by non-terminal.
+    nonterminals_by_id (list): Non-terminals ordered by their index.
+    file_path(str): A path of the file this grammar is loaded from or None if
+        the grammar is not loaded from a file. Used for LR table caching.
 
     """
 
@@ -243,6 +254,7 @@ class Grammar(object):
             root_symbol if root_symbol else productions[0].symbol
         self.recognizers = recognizers if recognizers else {}
         self._no_check_recognizers = _no_check_recognizers
+        self.file_path = None
 
         self._init_grammar()
 
@@ -293,6 +305,7 @@ class Grammar(object):
                                if isinstance(p.symbol, NonTerminal)]
 
         self._enumerate_productions()
+        self._enumerate_symbols()
 
     def _collect_grammar_symbols(self):
         """
@@ -401,13 +414,48 @@ class Grammar(object):
     def _enumerate_productions(self):
         """
         Enumerates all productions (prod_id) and production per symbol
-        (prod_symbol_id).
+        (prod_symbol_id). Index productions by their LHS symbol.
         """
         idx_per_symbol = {}
+        self.productions_by_symbol = {}
         for idx, s in enumerate(self.productions):
             s.prod_id = idx
+            s.grammar = self
             s.prod_symbol_id = idx_per_symbol.get(s.symbol, 0)
             idx_per_symbol[s.symbol] = idx_per_symbol.get(s.symbol, 0) + 1
+            self.productions_by_symbol.setdefault(s.symbol, []).append(s)
+
+    def _enumerate_symbols(self):
+        """
+        Enumerates terminals and non-terminals in the order of their names.
+        Ids are kept on the grammar as special symbols (EMPTY, EOF, STOP, S')
+        are shared among grammars.
+        """
+        self.terminals_by_id = sorted(self.terminals, key=lambda t: t.name)
+        self.terminal_ids = dict([(t, idx) for idx, t
+                                  in enumerate(self.terminals_by_id)])
+        self.nonterminals_by_id = sorted(self.nonterminals,
+                                         key=lambda n: n.name)
+        self.nonterminal_ids = dict([(n, idx) for idx, n
+                                     in enumerate(self.nonterminals_by_id)])
+
+    def terminals_to_bitset(self, terminals):
+        "Returns int bitset for the given iterable of terminals."
+        bitset = 0
+        terminal_ids = self.terminal_ids
+        for t in terminals:
+            bitset |= 1 << terminal_ids[t]
+        return bitset
+
+    def bitset_to_terminals(self, bitset):
+        "Returns a list of terminals from the given int bitset."
+        terminals = []
+        terminals_by_id = self.terminals_by_id
+        while bitset:
+            lowest = bitset & -bitset
+            terminals.append(terminals_by_id[lowest.bit_length() - 1])
+            bitset ^= lowest
+        return terminals
 
     def get_terminal(self, name):
         "Returns terminal with the given name."
@@ -487,6 +535,7 @@ class Grammar(object):
         g = Grammar(get_grammar_parser(parse_debug).parse_file(file_name),
                     recognizers=recognizers,
                     _no_check_recognizers=_no_check_recognizers)
+        g.file_path = file_name
         if debug:
             g.print_debug()
         return g
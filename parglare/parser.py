@@ -3,7 +3,7 @@ from __future__ import unicode_literals, print_function
 import codecs
 import sys
 from collections import OrderedDict
-from .grammar import Grammar, EMPTY, AUGSYMBOL, EOF, STOP
+from .grammar import Grammar, NonTerminal, EMPTY, AUGSYMBOL, EOF, STOP
 from .errors import Error, expected_symbols_str
 from .exceptions import ParseError, DisambiguationError, \
     DynamicDisambiguationConflict, disambiguation_error, \
@@ -21,18 +21,29 @@ ACCEPT = 2
 # Tables construction algorithms
 SLR = 0
 LALR = 1
+LALR_DP = 2
 
 
 class Parser(object):
     """Parser works like a DFA driven by LR tables. For a given grammar LR table
     will be created and cached or loaded from cache if cache is found.
+
+    The cache is used only for grammars loaded from file (see
+    `Grammar.from_file`). The table is stored next to the grammar file in a
+    file with `.pgt` extension and it is reused as long as the grammar and the
+    table construction parameters are unchanged.
+
+    If `compact_table` is set the LR table is compiled to CompactTable which
+    keeps actions and gotos in flat integer arrays. With table caching the
+    compact table is stored in a binary file with `.pgc` extension and used
+    in place through `mmap`.
     """
     def __init__(self, grammar, start_production=1, actions=None,
                  layout_actions=None, debug=False, debug_trace=False,
                  debug_layout=False, ws='\n\t ', build_tree=False,
                  tables=LALR, layout=False, position=False,
                  prefer_shifts=False, error_recovery=False,
-                 dynamic_filter=None):
+                 dynamic_filter=None, table_cache=True, compact_table=False):
         self.grammar = grammar
         self.start_production = start_production
         self.sem_actions = actions if actions else {}
@@ -46,7 +57,9 @@ class Parser(object):
                                             actions=layout_actions,
                                             ws=None, layout=True,
                                             position=True,
-                                            debug=debug_layout)
+                                            debug=debug_layout,
+                                            table_cache=table_cache,
+                                            compact_table=compact_table)
 
         self.layout = layout
         # If user recognizers are registered disable white-space skipping
@@ -64,13 +77,62 @@ class Parser(object):
         self.dynamic_filter = dynamic_filter
 
         from .closure import LR_0, LR_1
-        from .tables import create_table
+        from .tables import create_table, load_table, save_table, \
+            table_file_name, table_fingerprint
+        from .compact import CompactTable, compact_table_file_name
         if tables == SLR:
             itemset_type = LR_0
         else:
             itemset_type = LR_1
-        self.table = create_table(grammar, itemset_type=itemset_type,
-                                  start_production=start_production)
+        lalr_dp = tables == LALR_DP
+
+        self.table = None
+        cache_file = None
+        compact_file = None
+        if table_cache and grammar.file_path:
+            cache_file = table_file_name(grammar, start_production)
+            fingerprint = table_fingerprint(grammar, itemset_type,
+                                             start_production, lalr_dp)
+            if compact_table:
+                compact_file = compact_table_file_name(cache_file)
+                self.table = CompactTable.load(compact_file, grammar,
+                                               fingerprint, start_production)
+                if debug and self.table:
+                    print("*** Compact table loaded from '{}'.".format(
+                        compact_file))
+
+            if self.table is None:
+                self.table = load_table(cache_file, grammar,
+                                        itemset_type=itemset_type,
+                                        start_production=start_production,
+                                        lalr_dp=lalr_dp)
+                if debug and self.table:
+                    print("*** LR table loaded from '{}'.".format(
+                        cache_file))
+
+        if self.table is None:
+            self.table = create_table(grammar, itemset_type=itemset_type,
+                                      start_production=start_production,
+                                      lalr_dp=lalr_dp)
+            if cache_file:
+                save_table(cache_file, self.table,
+                           itemset_type=itemset_type,
+                           start_production=start_production,
+                           lalr_dp=lalr_dp)
+
+        if compact_table and not isinstance(self.table, CompactTable):
+            self.table = CompactTable.from_table(self.table)
+            if compact_file:
+                # Run from the mapped file so that the table memory is shared
+                # with other processes using the same grammar.
+                try:
+                    self.table.save(compact_file, fingerprint)
+                except (IOError, OSError):
+                    pass
+                else:
+                    self.table = CompactTable.load(
+                        compact_file, grammar, fingerprint,
+                        start_production) or self.table
 
         self._check_parser()
         if debug:
@@ -157,8 +219,10 @@ class Parser(object):
                 print("Current state =", cur_state.state_id)
 
             actions = cur_state.actions
+            default_reduction = cur_state.default_reduction
 
-            if new_token or ntok.symbol not in actions:
+            if default_reduction is None \
+               and (new_token or ntok.symbol not in actions):
                 # Try to recognize a new token in the input only after
                 # successful SHIFT operation, i.e. when the input position has
                 # moved. REDUCE operation doesn't move position. If the current
@@ -185,13 +249,23 @@ class Parser(object):
             context.end_position = position + len(ntok.value)
             context.layout_content = layout_content
 
-            if debug:
-                print("\tContext:", position_context(input_str, position))
-                print("\tTokens expected: {}"
-                      .format(expected_symbols_str(actions.keys())))
-                print("\tToken ahead: {}".format(ntok))
+            if default_reduction is not None:
+                # The only possible action in this state is the reduction by
+                # the same production whatever the lookahead is. Reduce
+                # without scanning. The next token is recognized in the first
+                # state that needs it.
+                if debug:
+                    print("\tDefault reduction.")
+                acts = [default_reduction]
+            else:
+                if debug:
+                    print("\tContext:", position_context(input_str,
+                                                         position))
+                    print("\tTokens expected: {}"
+                          .format(expected_symbols_str(actions.keys())))
+                    print("\tToken ahead: {}".format(ntok))
 
-            acts = actions.get(ntok.symbol)
+                acts = actions.get(ntok.symbol)
 
             if not acts:
 
@@ -692,14 +766,15 @@ class LRItem(object):
     Represents an item in the items set. Item is defined by a production and a
     position inside production (the dot). If the item is of LR_1 type follow
     set is also defined. Follow set is a set of terminals that can follow
-    non-terminal at given position in the given production.
+    non-terminal at given position in the given production. It is represented
+    as int bitset of terminal ids (see `Grammar.terminal_ids`).
     """
     __slots__ = ('production', 'position', 'follow')
 
-    def __init__(self, production, position, follow=None):
+    def __init__(self, production, position, follow=0):
         self.production = production
         self.position = position
-        self.follow = set() if not follow else follow
+        self.follow = follow
 
     def __eq__(self, other):
         return other and self.production == other.production and \
@@ -708,6 +783,9 @@ class LRItem(object):
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return hash((self.production.prod_id, self.position))
+
     def __repr__(self):
         return str(self)
 
@@ -721,13 +799,20 @@ class LRItem(object):
             s.append(".")
         s = " ".join(s)
 
-        follow = "{{{}}}".format(", ".join([str(t) for t in self.follow])) \
-                 if self.follow else "{}"
+        follow = "{{{}}}".format(", ".join(
+            [str(t) for t in self.follow_terminals])) if self.follow else "{}"
 
         return "%d: %s = %s   %s" % (self.production.prod_id,
                                      self.production.symbol, s,
                                      follow)
 
+    @property
+    def follow_terminals(self):
+        """
+        Returns a list of terminals from the follow set.
+        """
+        return self.production.grammar.bitset_to_terminals(self.follow)
+
     @property
     def is_kernel(self):
         """
@@ -778,10 +863,16 @@ class LRState(object):
         ambiguity strategy callable is called for the terminal symbol
         lookahead.
     finish_flags:
+    default_reduction(Action): REDUCE action which is done in this state
+        without looking at the next token or None. See
+        `LRTable.calc_default_reductions`.
+    kernel_key(frozenset): A set of (prod_id, position) pairs of kernel items.
+        Used as a hashable identity of the state during table construction.
 
     """
     __slots__ = ['grammar', 'state_id', 'symbol', 'items',
                  'actions', 'gotos', 'dynamic', 'finish_flags',
+                 'default_reduction', 'kernel_key',
                  '_per_next_symbol', '_max_prior_per_symbol']
 
     def __init__(self, grammar, state_id, symbol, items):
@@ -793,21 +884,23 @@ class LRState(object):
         self.actions = OrderedDict()
         self.gotos = OrderedDict()
         self.dynamic = set()
+        self.default_reduction = None
+
+        # Closure only adds non-kernel items thus the kernel of the state
+        # never changes.
+        self.kernel_key = frozenset([(i.production.prod_id, i.position)
+                                     for i in self.items if i.is_kernel])
 
     def __eq__(self, other):
         """Two states are equal if their kernel items are equal."""
-        this_kernel = [x for x in self.items if x.is_kernel]
-        other_kernel = [x for x in other.items if x.is_kernel]
-        if len(this_kernel) != len(other_kernel):
-            return False
-        for item in this_kernel:
-            if item not in other_kernel:
-                return False
-        return True
+        return self.kernel_key == other.kernel_key
 
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return hash(self.kernel_key)
+
     @property
     def kernel_items(self):
         """
@@ -1013,30 +1106,36 @@ def follow(grammar, first_sets=None):
     if first_sets is None:
         first_sets = first(grammar)
 
-    follow_sets = {}
+    # Sets are calculated as int bitsets of terminal ids.
+    empty = 1 << grammar.terminal_ids[EMPTY]
+    first_bitsets = dict([(s, grammar.terminals_to_bitset(f))
+                          for s, f in first_sets.items()])
+
+    follow_bitsets = {}
     for symbol in grammar.nonterminals:
-        follow_sets[symbol] = set()
+        follow_bitsets[symbol] = 0
 
     additions = True
     while additions:
         additions = False
-        for symbol in grammar.nonterminals:
-            for p in grammar.productions:
-                for idx, s in enumerate(p.rhs):
-                    if s == symbol:
-                        prod_follow = set()
-                        for rsymbol in p.rhs[idx+1:]:
-                            sfollow = first_sets[rsymbol]
-                            prod_follow.update(sfollow)
-                            if EMPTY not in sfollow:
-                                break
-                        else:
-                            prod_follow.update(follow_sets[p.symbol])
-                        prod_follow.discard(EMPTY)
-                        if prod_follow.difference(follow_sets[symbol]):
-                            additions = True
-                            follow_sets[symbol].update(prod_follow)
-    return follow_sets
+        for p in grammar.productions:
+            # Going backwards, collect terminals that can follow the current
+            # RHS symbol. If all symbols after the current one can derive
+            # EMPTY the follow of the production symbol is inherited.
+            prod_follow = follow_bitsets[p.symbol]
+            for s in reversed(p.rhs):
+                if isinstance(s, NonTerminal) \
+                        and prod_follow & ~follow_bitsets[s]:
+                    additions = True
+                    follow_bitsets[s] |= prod_follow
+                sfirst = first_bitsets[s]
+                if sfirst & empty:
+                    prod_follow |= sfirst & ~empty
+                else:
+                    prod_follow = sfirst
+
+    return dict([(symbol, set(grammar.bitset_to_terminals(f)))
+                 for symbol, f in follow_bitsets.items()])
 
 
 def pos_to_line_col(input_str, position):
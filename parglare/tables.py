@@ -1,17 +1,31 @@
 from __future__ import print_function, unicode_literals
-from collections import OrderedDict
+import os
+import json
+import hashlib
+from collections import OrderedDict, deque
 from itertools import chain
 from parglare.parser import LRItem, LRState
 from parglare import NonTerminal
 from .grammar import ProductionRHS, AUGSYMBOL, ASSOC_LEFT, ASSOC_RIGHT, STOP, \
-    StringRecognizer
+    EMPTY, StringRecognizer, RegExRecognizer
 from .exceptions import GrammarError, SRConflict, RRConflict
 from .parser import Action, SHIFT, REDUCE, ACCEPT, first, follow
-from .closure import closure, LR_1
+from .closure import closure, ClosureCache, LR_0, LR_1
 
 
 def create_table(grammar, first_sets=None, follow_sets=None,
-                 itemset_type=LR_1, start_production=1):
+                 itemset_type=LR_1, start_production=1, lalr_dp=False):
+    """
+    Creates LR table for the given grammar.
+
+    Args:
+    itemset_type(int): LR_0 for SLR tables or LR_1 for LALR tables.
+    start_production(int): The id of the production to start from.
+    lalr_dp(bool): If True, LALR lookaheads are calculated by the
+        DeRemer-Pennello algorithm over the LR(0) automaton. Merging of states
+        to avoid R/R conflicts is not done in that case so these tables are
+        pure LALR tables. Used only for LR_1 itemset type.
+    """
 
     first_sets = first_sets if first_sets else first(grammar)
 
@@ -25,25 +39,40 @@ def create_table(grammar, first_sets=None, follow_sets=None,
 
     follow_sets = follow_sets if follow_sets else follow(grammar, first_sets)
 
-    start_prod_symbol = grammar.productions[start_production].symbol
-    grammar.productions[0].rhs = ProductionRHS([start_prod_symbol, STOP])
+    _init_start_production(grammar, start_production)
+
+    # Sets of terminals are represented as int bitsets during table
+    # construction.
+    first_bitsets = dict([(s, grammar.terminals_to_bitset(f))
+                          for s, f in first_sets.items()])
+
+    # For DeRemer-Pennello LALR lookaheads LR(0) automaton is built first.
+    lalr_dp = lalr_dp and itemset_type is LR_1
+    closure_type = LR_0 if lalr_dp else itemset_type
 
     # Create a state for the first production (augmented)
     s = LRState(grammar, 0, AUGSYMBOL,
-                [LRItem(grammar.productions[0], 0, set())])
+                [LRItem(grammar.productions[0], 0)])
 
-    state_queue = [s]
+    state_queue = deque([s])
     state_id = 1
 
     states = []
 
+    # States keyed by their kernel. If LALR merging fails for some kernel
+    # (see merge_states) more states will have the same kernel. In that
+    # case the first created state is kept here.
+    states_by_kernel = {s.kernel_key: s}
+
+    closure_cache = ClosureCache()
+
     while state_queue:
         # For each state calculate its closure first, i.e. starting from a
         # so called "kernel items" expand collection with non-kernel items.
         # We will also calculate GOTO and ACTIONS dicts for each state. These
         # dicts will be keyed by a grammar symbol.
-        state = state_queue.pop(0)
-        closure(state, itemset_type, first_sets)
+        state = state_queue.popleft()
+        closure(state, closure_type, first_bitsets, closure_cache)
         states.append(state)
 
         # To find out other states we examine following grammar symbols
@@ -74,16 +103,8 @@ def create_table(grammar, first_sets=None, follow_sets=None,
         for symbol, items in state._per_next_symbol.items():
             inc_items = [i.get_pos_inc() for i in items]
             maybe_new_state = LRState(grammar, state_id, symbol, inc_items)
-            target_state = maybe_new_state
-            try:
-                idx = states.index(maybe_new_state)
-                target_state = states[idx]
-            except ValueError:
-                try:
-                    idx = state_queue.index(maybe_new_state)
-                    target_state = state_queue[idx]
-                except ValueError:
-                    pass
+            target_state = states_by_kernel.setdefault(
+                maybe_new_state.kernel_key, maybe_new_state)
 
             # We've found a new state. Register it for later processing.
             if target_state is maybe_new_state:
@@ -91,7 +112,7 @@ def create_table(grammar, first_sets=None, follow_sets=None,
                 state_id += 1
             else:
                 # State with this kernel items already exists.
-                if itemset_type is LR_1:
+                if closure_type is LR_1:
                     # LALR: Try to merge states, i.e. update items follow sets.
                     if not merge_states(target_state, maybe_new_state):
                         target_state = maybe_new_state
@@ -113,9 +134,12 @@ def create_table(grammar, first_sets=None, follow_sets=None,
                     # ACTION table.
                     state.actions[symbol] = [Action(SHIFT, state=target_state)]
 
+    if lalr_dp:
+        _calc_lalr_lookaheads(states, first_bitsets)
+
     # For LR(1) itemsets refresh/propagate item's follows as the LALR
     # merging might change item's follow in previous states
-    if itemset_type is LR_1:
+    elif itemset_type is LR_1:
 
         # Propagate updates as long as there were items propagated in the last
         # loop run.
@@ -126,20 +150,24 @@ def create_table(grammar, first_sets=None, follow_sets=None,
             for state in states:
 
                 # First refresh current state's follows
-                closure(state, LR_1, first_sets)
+                closure(state, LR_1, first_bitsets, closure_cache)
 
                 # Propagate follows to next states. GOTOs/ACTIONs keep
                 # information about states created from this state
-                inc_items = [i.get_pos_inc() for i in state.items]
+                inc_items = {}
+                for i in state.items:
+                    inc_item = i.get_pos_inc()
+                    if inc_item:
+                        inc_items[inc_item] = inc_item
                 for target_state in chain(
                         state.gotos.values(),
                         [a.state for i in state.actions.values()
                          for a in i if a.action is SHIFT]):
                     for next_item in target_state.kernel_items:
-                        this_item = inc_items[inc_items.index(next_item)]
-                        if this_item.follow.difference(next_item.follow):
+                        this_item = inc_items[next_item]
+                        if this_item.follow & ~next_item.follow:
                             update = True
-                            next_item.follow.update(this_item.follow)
+                            next_item.follow |= this_item.follow
 
     # Calculate REDUCTION entries in ACTION tables and resolve possible
     # conflicts.
@@ -153,7 +181,7 @@ def create_table(grammar, first_sets=None, follow_sets=None,
                 # from the FOLLOW set of item (LR(1)) or the production LHS
                 # non-terminal (LR(0)).
                 if itemset_type is LR_1:
-                    f_set = i.follow
+                    f_set = i.follow_terminals
                 else:
                     f_set = follow_sets[i.production.symbol]
 
@@ -223,36 +251,156 @@ def create_table(grammar, first_sets=None, follow_sets=None,
                                                      if x.action is not REDUCE]
                                     actions[t].append(new_reduce)
 
-    # Scanning optimization. Preorder actions based on terminal priority and
-    # specificity. Set _finish flags.
-    def act_order(act_item):
-        """Priority is the strongest property. After that honor string recognizer over
-        other types of recognizers.
-        """
-        symbol, act = act_item
-        return symbol.prior * 1000000 + (500000 + len(symbol.recognizer.value)
-                                         if type(symbol.recognizer)
-                                         is StringRecognizer else 0)
-    for state in states:
-        finish_flags = []
-        state.actions = OrderedDict(sorted(state.actions.items(),
-                                           key=act_order, reverse=True))
-        # Finish flags
-        prior = None
-        for symbol, act in reversed(list(state.actions.items())):
-            finish_flags.append(symbol.finish
-                                or (symbol.prior > prior if prior else False)
-                                or type(symbol.recognizer) is StringRecognizer)
-            prior = symbol.prior
-
-        finish_flags.reverse()
-        state.finish_flags = finish_flags
-
     table = LRTable(states, first_sets, follow_sets, grammar)
+    table.sort_actions()
     table.calc_conflicts()
+    table.calc_default_reductions()
     return table
 
 
+def _init_start_production(grammar, start_production):
+    """
+    Augmented production (S' -> S STOP) is connected to the LHS symbol of the
+    given start production.
+    """
+    start_prod_symbol = grammar.productions[start_production].symbol
+    grammar.productions[0].rhs = ProductionRHS([start_prod_symbol, STOP])
+
+
+def _calc_lalr_lookaheads(states, first_sets):
+    """
+    Calculates LALR(1) lookaheads for the states of the LR(0) automaton using
+    the DeRemer-Pennello algorithm. Lookaheads are stored in the follow sets of
+    the items at the end. First sets are given as int bitsets.
+
+    See: DeRemer, F., Pennello, T., Efficient Computation of LALR(1)
+    Look-Ahead Sets, ACM TOPLAS, 1982.
+    """
+
+    grammar = states[0].grammar
+    empty = 1 << grammar.terminal_ids[EMPTY]
+
+    def nullable(symbol):
+        return first_sets[symbol] & empty
+
+    def goto(state, symbol):
+        if isinstance(symbol, NonTerminal):
+            return state.gotos[symbol]
+        return state.actions[symbol][0].state
+
+    # Non-terminal transitions (state, non-terminal) are the nodes of the
+    # reads and includes relations.
+    transitions = [(state, nt) for state in states for nt in state.gotos]
+
+    # Directly read terminals are terminals shifted from the transition target
+    # state. Transition 'reads' transitions on nullable non-terminals from
+    # the target state.
+    direct_reads = {}
+    reads = {}
+    for trans in transitions:
+        state, nt = trans
+        target = state.gotos[nt]
+        direct_reads[trans] = grammar.terminals_to_bitset(target.actions)
+        reads[trans] = [(target, n) for n in target.gotos if nullable(n)]
+
+    read_sets = _digraph(transitions, reads, direct_reads)
+
+    # Transition (p, A) 'includes' (p', B) if there is a production
+    # B: b A g where g is nullable and p is reached from p' by b.
+    # Item at the end of B: w in state q has 'lookback' to (p', B) if q is
+    # reached from p' by w.
+    includes = {}
+    lookback = {}
+    prod_rhs = {}
+    for state in states:
+        for item in state.items:
+            if item.position != 0:
+                continue
+            prod = item.production
+            source = (state, prod.symbol)
+            if prod.symbol not in state.gotos:
+                # Augmented production
+                continue
+            if prod not in prod_rhs:
+                rhs = [prod.rhs[idx] for idx in range(len(prod.rhs))]
+                # For each position a flag whether the rest of the production
+                # after the position is nullable.
+                rest_nullable = [True] * len(rhs)
+                for idx in reversed(range(len(rhs) - 1)):
+                    rest_nullable[idx] = rest_nullable[idx + 1] \
+                        and nullable(rhs[idx + 1])
+                prod_rhs[prod] = rhs, rest_nullable
+            rhs, rest_nullable = prod_rhs[prod]
+            q = state
+            for idx, symbol in enumerate(rhs):
+                if isinstance(symbol, NonTerminal) and rest_nullable[idx]:
+                    includes.setdefault((q, symbol), []).append(source)
+                q = goto(q, symbol)
+            lookback.setdefault((q, prod), []).append(source)
+
+    follow_sets = _digraph(transitions, includes, read_sets)
+
+    for state in states:
+        for item in state.items:
+            if item.is_at_end:
+                for trans in lookback.get((state, item.production), []):
+                    item.follow |= follow_sets[trans]
+
+
+def _digraph(nodes, relation, initial):
+    """
+    Calculates for each node x the set F(x) which is the union of the initial
+    set of x and F(y) for all nodes y such that x is in the relation with y.
+    Nodes from the same strongly connected component get the same set.
+    Traversal is iterative to avoid recursion limit on large grammars.
+
+    Args:
+    nodes(list): All nodes.
+    relation(dict): A list of related nodes keyed by node.
+    initial(dict): An initial set as int bitset keyed by node.
+    """
+    result = {}
+    depth = {}
+    stack = []
+    done = float('inf')
+
+    for start in nodes:
+        if start in depth:
+            continue
+        stack.append(start)
+        depth[start] = len(stack)
+        result[start] = initial[start]
+        work = [(start, len(stack), iter(relation.get(start, [])))]
+        while work:
+            x, x_depth, related = work[-1]
+            for y in related:
+                if y not in depth:
+                    stack.append(y)
+                    depth[y] = len(stack)
+                    result[y] = initial[y]
+                    work.append((y, len(stack),
+                                 iter(relation.get(y, []))))
+                    break
+                depth[x] = min(depth[x], depth[y])
+                result[x] |= result[y]
+            else:
+                work.pop()
+                if depth[x] == x_depth:
+                    # x is the root of the strongly connected component.
+                    while True:
+                        top = stack.pop()
+                        depth[top] = done
+                        result[top] = result[x]
+                        if top == x:
+                            break
+                if work:
+                    parent = work[-1][0]
+                    depth[parent] = min(depth[parent], depth[x])
+                    result[parent] |= result[x]
+
+    return result
+
+
 def merge_states(old_state, new_state):
     """Try to merge new_state to old_state if possible. If not possible return
     False.
@@ -266,23 +414,21 @@ def merge_states(old_state, new_state):
     if old_state != new_state:
         return False
 
+    new_items = dict([(i, i) for i in new_state.items])
     item_pairs = []
     for old_item in (s for s in old_state.kernel_items if s.is_at_end):
-        new_item = new_state.get_item(old_item)
-        item_pairs.append((old_item, new_item))
+        item_pairs.append((old_item, new_items[old_item]))
 
     # Check if merging would result in additional R/R conflict
     for old, new in item_pairs:
-        (new.follow.difference(old.follow))
         for s in (s for s in old_state.kernel_items
                   if s.is_at_end and s is not old):
-            if s.follow.intersection(
-                    new.follow.difference(old.follow)):
+            if s.follow & new.follow & ~old.follow:
                 return False
 
     # Do the merge
     for old, new in item_pairs:
-        old.follow.update(new.follow)
+        old.follow |= new.follow
     return True
 
 
@@ -311,6 +457,63 @@ class LRTable(object):
         self.follow_sets = follow_sets
         self.grammar = grammar
 
+    def sort_actions(self):
+        """
+        Scanning optimization. Preorder actions based on terminal priority and
+        specificity. Set _finish flags.
+        """
+        def act_order(act_item):
+            """Priority is the strongest property. After that honor string
+            recognizer over other types of recognizers.
+            """
+            symbol, act = act_item
+            return symbol.prior * 1000000 + \
+                (500000 + len(symbol.recognizer.value)
+                 if type(symbol.recognizer) is StringRecognizer else 0)
+
+        for state in self.states:
+            finish_flags = []
+            state.actions = OrderedDict(sorted(state.actions.items(),
+                                               key=act_order, reverse=True))
+            # Finish flags
+            prior = None
+            for symbol, act in reversed(list(state.actions.items())):
+                finish_flags.append(
+                    symbol.finish
+                    or (symbol.prior > prior if prior else False)
+                    or type(symbol.recognizer) is StringRecognizer)
+                prior = symbol.prior
+
+            finish_flags.reverse()
+            state.finish_flags = finish_flags
+
+    def calc_default_reductions(self):
+        """
+        Find states where the only possible action is a reduction by the same
+        non-empty production whatever the lookahead is. The LR parser reduces
+        in these states without scanning for the next token.
+
+        States with dynamic disambiguation are skipped as dynamic filters
+        are called with the lookahead token.
+        """
+        for state in self.states:
+            state.default_reduction = None
+            if state.dynamic or not state.actions:
+                continue
+            default_reduction = None
+            for acts in state.actions.values():
+                if len(acts) != 1 or acts[0].action is not REDUCE:
+                    break
+                prod = acts[0].prod
+                if default_reduction is None:
+                    if not prod.rhs or prod.dynamic:
+                        break
+                    default_reduction = acts[0]
+                elif prod is not default_reduction.prod:
+                    break
+            else:
+                state.default_reduction = default_reduction
+
     def calc_conflicts(self):
         """
         Determine S/R and R/R conflicts.
@@ -386,3 +589,193 @@ class LRTable(object):
             print("\n\n*** R/R conflicts ***\n")
             for rrc in self.rr_conflicts:
                 print(rrc.message)
+
+
+# Version of the table cache file format. Must be incremented whenever the
+# format or the construction of the LR automaton changes as that makes all
+# previously cached tables invalid.
+TABLE_CACHE_VERSION = 2
+
+
+def table_file_name(grammar, start_production=1):
+    """
+    Returns the name of the LR table cache file for the given grammar loaded
+    from file. The cache file is placed next to the grammar file with the
+    `.pgt` extension.
+    """
+    base = os.path.splitext(grammar.file_path)[0]
+    if start_production != 1:
+        # Tables for non-default start productions (e.g. LAYOUT) are kept in a
+        # separate file.
+        base += '.' + grammar.productions[start_production].symbol.name
+    return base + '.pgt'
+
+
+def table_fingerprint(grammar, itemset_type=LR_1, start_production=1,
+                      lalr_dp=False):
+    """
+    Returns a fingerprint of everything that influences the construction of the
+    LR table for the given grammar: productions with their associativity,
+    priority and dynamic flag, terminals with their disambiguation rules and
+    recognizers, table type and start production.
+    """
+
+    def sym(symbol):
+        return '{}:{}'.format('N' if isinstance(symbol, NonTerminal) else 'T',
+                              symbol.name)
+
+    def recognizer(term):
+        if type(term.recognizer) is StringRecognizer:
+            return 'str:' + term.recognizer.value
+        elif type(term.recognizer) is RegExRecognizer:
+            return 'regex:' + term.recognizer._regex
+        return 'custom'
+
+    parts = ['version {}'.format(TABLE_CACHE_VERSION),
+             'itemset {} lalr_dp={}'.format(itemset_type, lalr_dp),
+             'start {} {}'.format(
+                 start_production,
+                 sym(grammar.productions[start_production].symbol))]
+
+    # Augmented production is skipped as its RHS is determined by the start
+    # production.
+    for p in grammar.productions[1:]:
+        parts.append('prod {} {} = {} assoc={} prior={} dynamic={}'.format(
+            p.prod_id, sym(p.symbol), ' '.join([sym(s) for s in p.rhs]),
+            p.assoc, p.prior, p.dynamic))
+
+    for t in sorted(grammar.terminals, key=lambda t: t.name):
+        parts.append('term {} prior={} finish={} prefer={} dynamic={} {}'
+                     .format(t.name, t.prior, t.finish, t.prefer, t.dynamic,
+                             recognizer(t)))
+
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def save_table(file_name, table, itemset_type=LR_1, start_production=1,
+               lalr_dp=False):
+    """
+    Persists the given LR table to the given file together with the
+    fingerprint of the grammar. Returns True if the table is saved.
+    """
+
+    def names(symbols):
+        return sorted([s.name for s in symbols])
+
+    def action(act):
+        if act.action is REDUCE:
+            return [act.action, act.prod.prod_id]
+        return [act.action, act.state.state_id]
+
+    states = []
+    for state in table.states:
+        states.append({
+            'symbol': state.symbol.name,
+            'items': [[i.production.prod_id, i.position,
+                       names(i.follow_terminals)]
+                      for i in state.items],
+            'actions': [[t.name, [action(a) for a in acts]]
+                        for t, acts in state.actions.items()],
+            'gotos': [[nt.name, target.state_id]
+                      for nt, target in state.gotos.items()],
+        })
+
+    content = {
+        'states': states,
+        'first_sets': dict([(s.name, names(f))
+                            for s, f in table.first_sets.items()]),
+        'follow_sets': dict([(s.name, names(f))
+                             for s, f in table.follow_sets.items()]),
+    }
+    data = {
+        'version': TABLE_CACHE_VERSION,
+        'fingerprint': table_fingerprint(table.grammar, itemset_type,
+                                         start_production, lalr_dp),
+        'checksum': _checksum(content),
+        'table': content,
+    }
+
+    try:
+        with open(file_name, 'w') as f:
+            f.write(json.dumps(data))
+    except (IOError, OSError):
+        # Caching is an optimization. If the table can't be written (e.g.
+        # read-only location) just continue without it.
+        return False
+    return True
+
+
+def load_table(file_name, grammar, itemset_type=LR_1, start_production=1,
+               lalr_dp=False):
+    """
+    Loads LR table from the given cache file. Returns None if the file
+    doesn't exist, is corrupted or it is created for a different grammar or
+    parameters, i.e. the fingerprint doesn't match.
+    """
+    try:
+        with open(file_name) as f:
+            data = json.loads(f.read())
+        if data['version'] != TABLE_CACHE_VERSION \
+           or data['fingerprint'] != table_fingerprint(
+               grammar, itemset_type, start_production, lalr_dp):
+            return None
+        if data['checksum'] != _checksum(data['table']):
+            # The content of the file is damaged.
+            return None
+        return _table_from_dict(data['table'], grammar, start_production)
+    except (IOError, OSError, ValueError, KeyError, IndexError, TypeError,
+            AttributeError):
+        return None
+
+
+def _checksum(content):
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _table_from_dict(data, grammar, start_production):
+
+    def get(seq, idx):
+        if type(idx) is not int or not 0 <= idx < len(seq):
+            raise IndexError(idx)
+        return seq[idx]
+
+    _init_start_production(grammar, start_production)
+
+    symbols = dict([(s.name, s)
+                    for s in chain(grammar.terminals, grammar.nonterminals)])
+    productions = grammar.productions
+
+    states = []
+    for state_id, s in enumerate(data['states']):
+        items = [LRItem(get(productions, prod_id), position,
+                        grammar.terminals_to_bitset(
+                            [symbols[n] for n in follow]))
+                 for prod_id, position, follow in s['items']]
+        states.append(LRState(grammar, state_id, symbols[s['symbol']],
+                              items))
+
+    def action(act, target):
+        if act == REDUCE:
+            return Action(REDUCE, prod=get(productions, target))
+        elif act in (SHIFT, ACCEPT):
+            return Action(act, state=get(states, target))
+        raise ValueError(act)
+
+    for state, s in zip(states, data['states']):
+        for term_name, acts in s['actions']:
+            state.actions[symbols[term_name]] = [action(a, target)
+                                                 for a, target in acts]
+        for nt_name, target in s['gotos']:
+            state.gotos[symbols[nt_name]] = get(states, target)
+
+    first_sets = dict([(symbols[n], set([symbols[x] for x in f]))
+                       for n, f in data['first_sets'].items()])
+    follow_sets = dict([(symbols[n], set([symbols[x] for x in f]))
+                        for n, f in data['follow_sets'].items()])
+
+    table = LRTable(states, first_sets, follow_sets, grammar)
+    table.sort_actions()
+    table.calc_conflicts()
+    table.calc_default_reductions()
+    return table
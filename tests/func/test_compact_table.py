@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Compact tables (CompactTable) must drive parsers the same way as LR tables
+they are compiled from.
+"""
+from __future__ import unicode_literals
+import os
+import pytest
+from parglare import Grammar, Parser, GLRParser
+from parglare.tables import create_table
+from parglare.compact import CompactTable, TABLE_ARRAYS
+from .expression_grammar import get_grammar as expression_grammar
+from .test_lalr_dp import grammar_files, grammars
+
+this_folder = os.path.abspath(os.path.dirname(__file__))
+
+
+def assert_tables_equal(table, compact):
+    assert len(table.states) == len(compact.states)
+    for state in table.states:
+        compact_state = compact.states[state.state_id]
+        assert compact_state.state_id == state.state_id
+        assert compact_state.symbol is state.symbol
+        assert list(compact_state.actions.keys()) == \
+            list(state.actions.keys())
+        for term, actions in state.actions.items():
+            assert [str(a) for a in compact_state.actions[term]] == \
+                [str(a) for a in actions]
+        assert [bool(f) for f in compact_state.finish_flags] == \
+            state.finish_flags
+        assert compact_state.dynamic == state.dynamic
+        assert sorted([(nt.name, s.state_id)
+                       for nt, s in compact_state.gotos.items()]) == \
+            sorted([(nt.name, s.state_id) for nt, s in state.gotos.items()])
+        for nt, target in state.gotos.items():
+            assert compact_state.gotos[nt].state_id == target.state_id
+
+        # Symbols not in the row are not found.
+        for term in state.grammar.terminals:
+            if term not in state.actions:
+                assert term not in compact_state.actions
+        for nt in state.grammar.nonterminals:
+            if nt not in state.gotos:
+                assert compact_state.gotos.get(nt) is None
+
+    assert [(c.state.state_id, c.term, c.productions)
+            for c in compact.sr_conflicts] == \
+        [(c.state.state_id, c.term, c.productions)
+         for c in table.sr_conflicts]
+    assert [(c.state.state_id, c.term, c.productions)
+            for c in compact.rr_conflicts] == \
+        [(c.state.state_id, c.term, c.productions)
+         for c in table.rr_conflicts]
+
+
+@pytest.mark.parametrize('grammar', grammars)
+def test_compact_table_grammars(grammar):
+    g = Grammar.from_string(grammar)
+    table = create_table(g)
+    assert_tables_equal(table, CompactTable.from_table(table))
+
+
+@pytest.mark.parametrize('grammar_file', grammar_files())
+def test_compact_table_grammar_files(grammar_file):
+    g = Grammar.from_file(grammar_file)
+    table = create_table(g)
+    assert_tables_equal(table, CompactTable.from_table(table))
+
+
+def test_compact_table_shared_rows():
+    """
+    Test that identical action and goto rows are stored once.
+    """
+    g = expression_grammar()
+    table = CompactTable.from_table(create_table(g))
+    action_rows = set(table.state_action_rows)
+    assert len(action_rows) < len(table.states)
+    assert len(table.action_row_starts) == len(action_rows) + 1
+    assert len(table.goto_base) == len(set(table.state_goto_rows))
+
+
+def test_compact_table_parser():
+    g = expression_grammar()
+    input_str = 'id + id * ( id + id ) * id'
+    result = Parser(g, build_tree=True).parse(input_str)
+    parser = Parser(g, build_tree=True, compact_table=True)
+    assert isinstance(parser.table, CompactTable)
+    assert parser.parse(input_str).tree_str() == result.tree_str()
+
+
+def test_compact_table_glr_parser():
+    grammar = r"""
+    E: E '+' E | E '*' E | '(' E ')' | number;
+    number: /\d+/;
+    """
+    g = Grammar.from_string(grammar)
+    input_str = '1 + 2 * 3 + 4'
+    results = GLRParser(g, build_tree=True).parse(input_str)
+    compact_results = GLRParser(g, build_tree=True,
+                                compact_table=True).parse(input_str)
+    assert len(compact_results) == len(results) == 5
+    assert sorted([r.tree_str() for r in compact_results]) == \
+        sorted([r.tree_str() for r in results])
+
+
+def test_compact_table_layout():
+    grammar = r"""
+    S: Item+;
+    Item: 'a' | 'b';
+    LAYOUT: LayoutItem | LAYOUT LayoutItem;
+    LayoutItem: WS | Comment | EMPTY;
+    WS: /\s+/;
+    Comment: /\/\/.*/;
+    """
+    g = Grammar.from_string(grammar)
+    parser = Parser(g, compact_table=True)
+    assert isinstance(parser.layout_parser.table, CompactTable)
+    assert parser.parse('a b // comment\n a') == ['a', 'b', 'a']
+
+
+@pytest.fixture
+def grammar_file(tmpdir):
+    file_name = str(tmpdir.join('expr.pg'))
+    with open(file_name, 'w') as f:
+        f.write(r"""
+        E: E '+' E  {left, 1}
+         | E '*' E  {left, 2}
+         | E '+' '+' E {dynamic}
+         | '(' E ')'
+         | number;
+        number: /\d+(\.\d+)?/;
+        """)
+    return file_name
+
+
+def test_compact_table_file(grammar_file):
+    g = Grammar.from_file(grammar_file)
+    table = create_table(g)
+    compact = CompactTable.from_table(table)
+    file_name = grammar_file + '.pgc'
+    compact.save(file_name, 'a' * 40)
+
+    loaded = CompactTable.load(file_name, g, 'a' * 40)
+    assert loaded is not None
+    for name in TABLE_ARRAYS:
+        assert list(getattr(loaded, name)) == list(getattr(compact, name))
+    assert_tables_equal(table, loaded)
+    # LR items are not kept in the compact table so they are missing from
+    # the conflict messages.
+    assert [c.message.splitlines()[-1] for c in loaded.sr_conflicts] == \
+        [c.message.splitlines()[-1] for c in table.sr_conflicts]
+
+    # Different fingerprint.
+    assert CompactTable.load(file_name, g, 'b' * 40) is None
+    # Non-existing file.
+    assert CompactTable.load(grammar_file + '.none', g, 'a' * 40) is None
+    # Damaged file.
+    with open(file_name, 'r+b') as f:
+        f.truncate(100)
+    assert CompactTable.load(file_name, g, 'a' * 40) is None
+
+
+def test_compact_table_file_parser(grammar_file):
+    g = Grammar.from_file(grammar_file)
+    parser = Parser(g, compact_table=True, prefer_shifts=True)
+    compact_file = os.path.splitext(grammar_file)[0] + '.pgc'
+    assert os.path.exists(compact_file)
+    # Parser runs from the mapped file.
+    assert parser.table._buffer is not None
+    assert parser.parse('1 + 2 * 3') == \
+        Parser(g, prefer_shifts=True).parse('1 + 2 * 3')
+
+    # The file is used on the next parser construction.
+    parser = Parser(Grammar.from_file(grammar_file), compact_table=True,
+                    prefer_shifts=True)
+    assert parser.table._buffer is not None
+    assert parser.parse('(1 + 2) * 3') == \
+        [['(', ['1', '+', '2'], ')'], '*', '3']
+
+    # Changed grammar invalidates the file.
+    with open(grammar_file, 'a') as f:
+        f.write("E: E '-' E {left, 1};")
+    parser = Parser(Grammar.from_file(grammar_file), compact_table=True,
+                    prefer_shifts=True)
+    assert parser.parse('1 - 2') == ['1', '-', '2']
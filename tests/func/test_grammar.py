@@ -243,3 +243,26 @@ def test_action_override():
         "Foo": lambda _, __: "eggs",
         "Bar": lambda _, __: "bar reduce"})
     assert result == ["eggs", "bar reduce"]
+
+
+def test_terminals_bitset():
+    """
+    Test that terminals are indexed and that sets of terminals can be
+    represented as int bitsets.
+    """
+    grammar = """
+    S: A "b" | "c";
+    A: "a" | EMPTY;
+    """
+
+    g = Grammar.from_string(grammar)
+    assert sorted(g.terminal_ids.values()) == list(range(len(g.terminals)))
+    for t in g.terminals:
+        assert g.terminals_by_id[g.terminal_ids[t]] is t
+
+    terminals = [g.get_terminal('b'), g.get_terminal('EMPTY'),
+                 g.get_terminal('STOP')]
+    bitset = g.terminals_to_bitset(terminals)
+    assert bin(bitset).count('1') == 3
+    assert set(g.bitset_to_terminals(bitset)) == set(terminals)
+    assert g.bitset_to_terminals(0) == []
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-check of LALR tables calculated by the DeRemer-Pennello algorithm
+(LALR_DP) against the tables calculated by the default LALR construction.
+"""
+from __future__ import unicode_literals
+import os
+import fnmatch
+import pytest
+from parglare import Grammar, Parser, GLRParser, LALR_DP
+from parglare.grammar import pg_productions, GRAMMAR
+from parglare.tables import create_table
+from parglare.exceptions import RRConflicts
+from .expression_grammar import get_grammar as expression_grammar
+from .expression_grammar_numbers import get_grammar as numbers_grammar
+
+this_folder = os.path.abspath(os.path.dirname(__file__))
+
+grammars = [
+    # Nullable non-terminals at the end and in the middle of productions.
+    """
+    S: A B C;
+    A: 'a' A | EMPTY;
+    B: 'b' | EMPTY;
+    C: 'c' | A;
+    """,
+    # Left and right recursion with nullable lists.
+    """
+    Program: Stmts;
+    Stmts: Stmts Stmt | EMPTY;
+    Stmt: 'if' Expr Block Else | Expr ';';
+    Else: 'else' Block | EMPTY;
+    Block: '{' Stmts '}';
+    Expr: Expr '+' Expr {left, 1}
+        | Expr '*' Expr {left, 2}
+        | Expr '^' Expr {right, 3}
+        | '(' Expr ')'
+        | ID '(' Args ')'
+        | ID;
+    Args: Args ',' Expr | Expr | EMPTY;
+    ID: /\\w+/;
+    """,
+    # Even length palindromes. Non-deterministic with S/R conflicts.
+    """
+    S: A | B | EMPTY;
+    A: '1' S '1';
+    B: '0' S '0';
+    """,
+    # Lookaheads propagated through the chain of nullable non-terminals.
+    """
+    S: 'x' A 'y' | 'z' A 'w' | A;
+    A: B C D;
+    B: 'b' | EMPTY;
+    C: 'c' | EMPTY;
+    D: 'd' | EMPTY;
+    """,
+]
+
+
+def grammar_files():
+    files = []
+    for folder in ['tests', 'examples']:
+        folder = os.path.join(this_folder, '..', '..', folder)
+        for dir_name, _, file_names in os.walk(folder):
+            for file_name in fnmatch.filter(file_names, '*.pg'):
+                file_name = os.path.join(dir_name, file_name)
+                try:
+                    Grammar.from_file(file_name)
+                except Exception:
+                    # Grammars that are invalid on purpose.
+                    continue
+                files.append(file_name)
+    return sorted(files)
+
+
+def table_summary(table):
+    """
+    Returns ACTION/GOTO tables in a form suitable for comparison.
+    """
+    return [(state.state_id, state.symbol.name,
+             sorted([(t.name, [str(a) for a in acts])
+                     for t, acts in state.actions.items()]),
+             sorted([(nt.name, target.state_id)
+                     for nt, target in state.gotos.items()]),
+             state.finish_flags)
+            for state in table.states]
+
+
+def check_tables(grammar):
+    start_productions = [1]
+    layout_prod = grammar.get_production_id('LAYOUT')
+    if layout_prod:
+        start_productions.append(layout_prod)
+
+    for start_production in start_productions:
+        lalr = create_table(grammar, start_production=start_production)
+        lalr_dp = create_table(grammar, start_production=start_production,
+                               lalr_dp=True)
+        assert table_summary(lalr_dp) == table_summary(lalr)
+        assert len(lalr_dp.sr_conflicts) == len(lalr.sr_conflicts)
+        assert len(lalr_dp.rr_conflicts) == len(lalr.rr_conflicts)
+
+
+@pytest.mark.parametrize('grammar', grammars)
+def test_lalr_dp_grammars(grammar):
+    check_tables(Grammar.from_string(grammar))
+
+
+@pytest.mark.parametrize('get_grammar', [expression_grammar, numbers_grammar])
+def test_lalr_dp_struct_grammars(get_grammar):
+    check_tables(get_grammar())
+
+
+def test_lalr_dp_pg_grammar():
+    """
+    parglare grammar language is used as a bigger grammar with layout.
+    """
+    check_tables(Grammar.from_struct(pg_productions, GRAMMAR))
+
+
+def test_lalr_dp_grammar_files():
+    files = grammar_files()
+    assert files
+    for file_name in files:
+        check_tables(Grammar.from_file(file_name))
+
+
+def test_lalr_dp_parsing():
+    grammar = Grammar.from_string(grammars[1])
+    for parser_class in [Parser, GLRParser]:
+        parser = parser_class(grammar, tables=LALR_DP)
+        results = parser.parse('if a + b * c { f(x, y); } else { g(); }')
+        if parser_class is GLRParser:
+            assert len(results) == 1
+
+
+def test_lalr_dp_reduce_reduce_conflict():
+    """
+    Tables calculated by DeRemer-Pennello algorithm are pure LALR tables. The
+    extended LALR used by default avoids R/R conflict for this grammar from
+    the Dragon Book by not merging states.
+    """
+
+    grammar = """
+    S: 'a' A 'd' | 'b' B 'd' | 'a' B 'e' | 'b' A 'e';
+    A: C;
+    B: C;
+    C: 'c';
+    """
+    grammar = Grammar.from_string(grammar)
+    Parser(grammar)
+
+    with pytest.raises(RRConflicts):
+        Parser(grammar, tables=LALR_DP)
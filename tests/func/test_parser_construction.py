@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import pytest  # noqa
-from parglare.parser import first, follow
-from parglare import Grammar, NonTerminal, Terminal, EMPTY
+from parglare.parser import first, follow, LRState, LRItem
+from parglare import Grammar, Parser, NonTerminal, Terminal, EMPTY
 from parglare.grammar import STOP
+from parglare.closure import closure, ClosureCache, LR_1
 from .expression_grammar import OPEN, ID, T, E, MULT, CLOSE, PLUS, get_grammar
 
 
@@ -62,3 +63,73 @@ def test_follow():
 
     # Follow of T must contain all of follow of E
     assert follow_set[T] == set([MULT, CLOSE, PLUS, STOP])
+
+
+def test_closure():
+    """
+    Test LR(1) closure calculation with nullable tails and recursion.
+    Memoized closure must give the same result for a new state with the same
+    kernel.
+    """
+
+    grammar = """
+    S: A B;
+    A: A "a" | "a";
+    B: "b" | EMPTY;
+    """
+
+    g = Grammar.from_string(grammar)
+    first_sets = dict([(s, g.terminals_to_bitset(f))
+                       for s, f in first(g).items()])
+    cache = ClosureCache()
+
+    def closed_state():
+        state = LRState(g, 0, g.get_nonterminal('S'),
+                        [LRItem(g.productions[0], 0)])
+        closure(state, LR_1, first_sets, cache)
+        return state
+
+    def state_items(state):
+        return [(i.production.prod_id, i.position,
+                 sorted([t.name for t in i.follow_terminals]))
+                for i in state.items]
+
+    state = closed_state()
+    assert state_items(state) == [
+        (0, 0, []),
+        (1, 0, ['STOP']),
+        (2, 0, ['STOP', 'a', 'b']),
+        (3, 0, ['STOP', 'a', 'b']),
+    ]
+
+    assert len(cache.kernels) == 1
+    assert state_items(closed_state()) == state_items(state)
+    assert len(cache.kernels) == 1
+
+
+def test_lr_states_identity():
+    """
+    Test that LR states are identified by their kernel items and that states
+    and items can be used as dict keys.
+    """
+    grammar = get_grammar()
+    table = Parser(grammar).table
+    states = table.states
+
+    # All states in LALR table have unique kernels.
+    assert len(set(states)) == len(states)
+    states_by_kernel = dict([(s.kernel_key, s) for s in states])
+    assert len(states_by_kernel) == len(states)
+
+    for state in states:
+        # New state with the same kernel items is equal to the existing state.
+        same = LRState(grammar, 1000, state.symbol,
+                       [LRItem(i.production, i.position)
+                        for i in state.kernel_items])
+        assert same == state
+        assert hash(same) == hash(state)
+        assert states_by_kernel[same.kernel_key] is state
+
+        items = dict([(i, i) for i in state.items])
+        for item in state.items:
+            assert items[LRItem(item.production, item.position)] is item
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import pytest
+from parglare import Grammar, Parser, GLRParser, SLR
+import parglare.tables as tables
+
+grammar = r"""
+E: E '+' E  {left, 1}
+ | E '*' E  {left, 2}
+ | '(' E ')'
+ | number;
+number: /\d+(\.\d+)?/;
+LAYOUT: LayoutItem | LAYOUT LayoutItem;
+LayoutItem: WS | Comment | EMPTY;
+WS: /\s+/;
+Comment: /\/\/.*/;
+"""
+
+
+def table_str(table):
+    """
+    Returns a string representation of the whole table used to check that
+    the table loaded from the cache is equal to the freshly created table.
+    """
+    s = []
+    for state in table.states:
+        s.append('{}:{}'.format(state.state_id, state.symbol))
+        s.append(str([(i.production.prod_id, i.position,
+                       sorted([t.name for t in i.follow_terminals]))
+                      for i in state.items]))
+        s.append(str(list(state.actions.items())))
+        s.append(str([(k, v.state_id) for k, v in state.gotos.items()]))
+        s.append(str(state.finish_flags))
+        s.append(str(sorted([t.name for t in state.dynamic])))
+    s.append(str(sorted([(str(k), sorted([str(x) for x in v]))
+                         for k, v in table.first_sets.items()])))
+    s.append(str(sorted([(str(k), sorted([str(x) for x in v]))
+                         for k, v in table.follow_sets.items()])))
+    s.append(str([(c.state.state_id, c.term, c.productions)
+                  for c in table.sr_conflicts]))
+    s.append(str([(c.state.state_id, c.term, c.productions)
+                  for c in table.rr_conflicts]))
+    return '\n'.join(s)
+
+
+@pytest.fixture
+def grammar_file(tmpdir):
+    file_name = str(tmpdir.join('expr.pg'))
+    with open(file_name, 'w') as f:
+        f.write(grammar)
+    return file_name
+
+
+def test_table_cache_created(grammar_file):
+    g = Grammar.from_file(grammar_file)
+    Parser(g)
+    cache_file = os.path.splitext(grammar_file)[0] + '.pgt'
+    assert os.path.exists(cache_file)
+    # Layout parser table is cached separately.
+    assert os.path.exists(
+        os.path.splitext(grammar_file)[0] + '.LAYOUT.pgt')
+
+
+@pytest.mark.parametrize('parser_class', [Parser, GLRParser])
+def test_table_cache_loaded(grammar_file, parser_class, monkeypatch):
+    g = Grammar.from_file(grammar_file)
+    fresh = parser_class(g, actions={'number': lambda _, v: float(v)},
+                         prefer_shifts=True)
+
+    def create_table(*args, **kwargs):
+        assert False, 'Table should be loaded from cache.'
+    monkeypatch.setattr(tables, 'create_table', create_table)
+
+    g = Grammar.from_file(grammar_file)
+    loaded = parser_class(g, actions={'number': lambda _, v: float(v)},
+                          prefer_shifts=True)
+
+    assert table_str(loaded.table) == table_str(fresh.table)
+    assert table_str(loaded.layout_parser.table) \
+        == table_str(fresh.layout_parser.table)
+
+    in_str = '1 + 2 * // comment\n (3 + 4)'
+    assert loaded.parse(in_str) == fresh.parse(in_str)
+
+
+def test_table_cache_table_type_change(grammar_file):
+    """
+    Test that the table is rebuilt if table construction parameters change.
+    """
+    g = Grammar.from_file(grammar_file)
+    lalr = Parser(g, prefer_shifts=True)
+    slr = Parser(g, prefer_shifts=True, tables=SLR)
+
+    g = Grammar.from_file(grammar_file)
+    assert table_str(Parser(g, prefer_shifts=True, tables=SLR).table) \
+        == table_str(slr.table)
+    assert table_str(Parser(g, prefer_shifts=True).table) \
+        == table_str(lalr.table)
+
+
+def test_table_cache_stale(grammar_file, monkeypatch):
+    """
+    Test that the cached table is rebuilt if the grammar changes.
+    """
+    Parser(Grammar.from_file(grammar_file), prefer_shifts=True)
+
+    with open(grammar_file, 'w') as f:
+        f.write(grammar.replace("| number;", "| '-' E | number;"))
+
+    called = []
+    create_table = tables.create_table
+
+    def spy_create_table(*args, **kwargs):
+        called.append(True)
+        return create_table(*args, **kwargs)
+    monkeypatch.setattr(tables, 'create_table', spy_create_table)
+
+    parser = Parser(Grammar.from_file(grammar_file), prefer_shifts=True)
+    assert called
+    parser.parse('- 1 + 2')
+
+    # New table is cached now.
+    monkeypatch.setattr(tables, 'create_table', create_table)
+    parser = Parser(Grammar.from_file(grammar_file), prefer_shifts=True)
+    parser.parse('- 1 + 2')
+
+
+def test_table_cache_corrupted(grammar_file):
+    """
+    Test that corrupted cache file is detected and the table is rebuilt.
+    """
+    fresh = Parser(Grammar.from_file(grammar_file), prefer_shifts=True)
+
+    cache_file = os.path.splitext(grammar_file)[0] + '.pgt'
+    with open(cache_file) as f:
+        content = f.read()
+
+    for corrupted in [content[:len(content) // 2],
+                      content.replace('"gotos": [[', '"gotos": [[12345, '),
+                      content.replace('[[1, ', '[[7, '),
+                      'garbage']:
+        with open(cache_file, 'w') as f:
+            f.write(corrupted)
+        parser = Parser(Grammar.from_file(grammar_file), prefer_shifts=True)
+        assert table_str(parser.table) == table_str(fresh.table)
+
+
+def test_table_cache_disabled(grammar_file):
+    g = Grammar.from_file(grammar_file)
+    Parser(g, table_cache=False)
+    assert not os.path.exists(os.path.splitext(grammar_file)[0] + '.pgt')
+
+    # Grammars not loaded from file are never cached.
+    g = Grammar.from_string(grammar)
+    assert g.file_path is None
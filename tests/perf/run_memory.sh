@@ -6,3 +6,9 @@ python test_memory_lr.py >> reports/${1}_memory_report_lr.txt
 
 python --version > reports/${1}_memory_report_glr.txt 2>&1 
 python test_memory_glr.py >> reports/${1}_memory_report_glr.txt
+
+python --version > reports/${1}_memory_report_tables.txt 2>&1
+python test_memory_tables.py >> reports/${1}_memory_report_tables.txt
+
+python --version > reports/${1}_memory_report_fork.txt 2>&1
+python test_memory_fork.py >> reports/${1}_memory_report_fork.txt
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Comparing private memory of pre-forked worker processes using a parser
+# built before the fork with LR table (LRTable) and with compact table
+# mapped from the table file (CompactTable). Linux only as private memory
+# is read from /proc.
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import gc
+import os
+import shutil
+import tempfile
+from os.path import join
+from parglare import Grammar, Parser
+from test_memory_tables import synthetic_grammar
+
+
+def private_memory():
+    "Returns private memory of the current process in KB."
+    with open('/proc/self/smaps_rollup') as f:
+        return sum([int(line.split()[1]) for line in f
+                    if line.startswith(('Private_Clean', 'Private_Dirty'))])
+
+
+def worker_memory(parser, input_str):
+    """
+    Forks a worker which runs garbage collection that visits all objects and
+    then parses the input. Returns private memory of the worker in KB gained
+    after the fork before and after parsing.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        start = private_memory()
+        gc.collect()
+        idle = private_memory() - start
+        parser.parse(input_str)
+        gc.collect()
+        os.write(write_fd, '{} {}'.format(
+            idle, private_memory() - start).encode('ascii'))
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 100).split()
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result[0]), int(result[1])
+
+
+def compare(statements):
+    grammar_str = synthetic_grammar(statements, as_string=True)
+    input_str = ' '.join(["kw{0} x = a * (b + {0}); kw{0}(a, b) {{ }}"
+                          .format(i) for i in range(statements)]) + ' '
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        grammar_file = join(tmp_dir, 'synthetic.pg')
+        with open(grammar_file, 'w') as f:
+            f.write(grammar_str)
+        # Create table files.
+        Parser(Grammar.from_file(grammar_file), compact_table=True)
+
+        print('Synthetic grammar, {} statement kinds.'.format(statements))
+        for title, compact in [('LRTable', False), ('CompactTable', True)]:
+            parser = Parser(Grammar.from_file(grammar_file),
+                            compact_table=compact)
+            gc.collect()
+            print('{}: {} KB per worker, {} KB after parsing'.format(
+                title, *worker_memory(parser, input_str)))
+        print()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def run():
+    for statements in [100, 400]:
+        compare(statements)
+
+
+if __name__ == '__main__':
+    run()
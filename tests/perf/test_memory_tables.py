@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Comparing memory used by LR tables (LRTable) and compiled compact
+# tables (CompactTable) for rhapsody grammar and a large synthetic
+# grammar.
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import gc
+import sys
+import types
+from os.path import dirname, join
+from parglare import Grammar, Parser
+from parglare.tables import create_table
+from parglare.compact import CompactTable
+
+
+def synthetic_grammar(statements, as_string=False):
+    """
+    Returns a grammar of a language with the given number of statement kinds
+    and ten expression hierarchies. If as_string is set the grammar is
+    returned as a string.
+    """
+    rules = ["Program: Stmts EOF;",
+             "Stmts: Stmts Stmt | Stmt;",
+             "Stmt: {};".format(" | ".join(["Stmt{}".format(i)
+                                            for i in range(statements)]))]
+    for i in range(statements):
+        rules.append("Stmt{0}: 'kw{0}' ID '=' Expr{1} ';' "
+                     "| 'kw{0}' '(' Args{0} ')' Block;".format(i, i % 10))
+        rules.append("Args{0}: Args{0} ',' Expr{1} | Expr{1} | EMPTY;"
+                     .format(i, i % 10))
+    rules.append("Block: '{' Stmts '}' | '{' '}';")
+    for i in range(10):
+        rules.append("Expr{0}: Expr{0} '+' Term{0} | Expr{0} '-' Term{0} "
+                     "| Term{0};".format(i))
+        rules.append("Term{0}: Term{0} '*' Factor{0} | Term{0} '/' Factor{0} "
+                     "| Factor{0};".format(i))
+        rules.append("Factor{0}: '(' Expr{0} ')' | ID | NUM "
+                     "| ID '(' Args{0} ')';".format(i))
+    rules.append(r"ID: /[a-zA-Z_][a-zA-Z_0-9]*/;")
+    rules.append(r"NUM: /\d+/;")
+    if as_string:
+        return "\n".join(rules)
+    return Grammar.from_string("\n".join(rules))
+
+
+def table_size(table):
+    """
+    Returns the size in bytes of all objects reachable from the given table
+    excluding the grammar and its symbols and productions.
+    """
+    grammar = table.grammar
+    seen = set([id(grammar)])
+    for obj in [grammar.productions, grammar.terminals, grammar.nonterminals,
+                grammar.terminals_by_id, grammar.nonterminals_by_id,
+                grammar.terminal_ids, grammar.nonterminal_ids]:
+        seen.add(id(obj))
+        seen.update([id(x) for x in obj])
+    for p in grammar.productions:
+        seen.add(id(p.rhs))
+
+    size = 0
+    to_visit = [table]
+    while to_visit:
+        obj = to_visit.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType,
+                                               types.FunctionType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        to_visit.extend(gc.get_referents(obj))
+    return size
+
+
+def compare(name, grammar, input_file=None):
+    table = create_table(grammar)
+    lr_size = table_size(table)
+    compact = CompactTable.from_table(table)
+    del table
+    compact_size = table_size(compact)
+
+    print(name)
+    print('States: {}'.format(len(compact.states)))
+    print('LRTable: {:.2f} KB'.format(lr_size / 1000))
+    print('CompactTable: {:.2f} KB ({:.1f}%)'.format(
+        compact_size / 1000, 100. * compact_size / lr_size))
+
+    if input_file:
+        # Compact states are created on the first access during parsing.
+        parser = Parser(grammar, compact_table=True, table_cache=False)
+        parser.parse_file(input_file)
+        print('CompactTable after parsing: {:.2f} KB'.format(
+            table_size(parser.table) / 1000))
+    print()
+
+
+def run():
+    this_folder = dirname(__file__)
+    compare('rhapsody.pg',
+            Grammar.from_file(join(this_folder, 'rhapsody.pg')),
+            join(this_folder, 'test_inputs', 'LightSwitch.rpy'))
+    for statements in [100, 400]:
+        compare('Synthetic grammar, {} statement kinds.'.format(statements),
+                synthetic_grammar(statements))
+
+
+if __name__ == '__main__':
+    run()